@@ -1,8 +1,9 @@
-import json
+import numpy as np
 from pathlib import Path
 from typing import Dict, List, Tuple
+from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.metrics import precision_score, recall_score, f1_score
-from utils import load_expected_outputs, text_similarity
+from utils import load_expected_outputs, read_json, text_similarity
 
 INPUT_FOLDER = "input"
 OUTPUT_FOLDER = "output" 
@@ -34,8 +35,7 @@ def evaluate_model_performance():
             continue
         
         # Load predicted output
-        with open(output_file, 'r', encoding='utf-8') as f:
-            predicted_data = json.load(f)
+        predicted_data = read_json(output_file)
         
         predicted_headings = predicted_data.get('outline', [])
         
@@ -69,49 +69,76 @@ def evaluate_model_performance():
         print(f"Average F1-Score: {avg_f1:.3f}")
         print(f"Average Hierarchy Accuracy: {avg_hierarchy:.3f}")
 
+def build_similarity_matrix(predicted_texts: List[str], expected_texts: List[str]) -> np.ndarray:
+    """Build the (P, E) text similarity matrix with one sparse matmul"""
+    pred_norm = [t.lower().strip() for t in predicted_texts]
+    exp_norm = [t.lower().strip() for t in expected_texts]
+
+    # Binary token counts reproduce the set semantics of text_similarity
+    vectorizer = CountVectorizer(binary=True, analyzer=str.split)
+    try:
+        vectorizer.fit(pred_norm + exp_norm)
+        pred_matrix = vectorizer.transform(pred_norm)
+        exp_matrix = vectorizer.transform(exp_norm)
+    except ValueError:
+        # Empty vocabulary (all texts blank)
+        return np.zeros((len(pred_norm), len(exp_norm)))
+
+    intersection = (pred_matrix @ exp_matrix.T).toarray()
+    pred_sizes = np.asarray(pred_matrix.sum(axis=1))
+    exp_sizes = np.asarray(exp_matrix.sum(axis=1))
+    union = pred_sizes + exp_sizes.T - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = np.where(union > 0, intersection / np.where(union > 0, union, 1), 0.0)
+
+    # Overlay the substring and exact-match bonuses used by text_similarity
+    substring = np.array([
+        [pt in et or et in pt for et in exp_norm]
+        for pt in pred_norm
+    ])
+    similarity[substring] = 0.8
+    exact = np.array(pred_norm, dtype=object)[:, None] == np.array(exp_norm, dtype=object)[None, :]
+    similarity[exact] = 1.0
+
+    return similarity
+
 def calculate_metrics(expected: List[Dict], predicted: List[Dict]) -> Tuple[float, float, float, float]:
     """Calculate precision, recall, F1, and hierarchy accuracy"""
     if not expected:
         return 0.0, 0.0, 0.0, 0.0
-    
+
+    if not predicted:
+        return 0.0, 0.0, 0.0, 0.0
+
     # Create text mappings
     expected_texts = [h['text'] for h in expected]
     predicted_texts = [h['text'] for h in predicted]
-    
-    # Find matches based on text similarity
-    matched_expected = set()
-    matched_predicted = set()
+
+    similarity = build_similarity_matrix(predicted_texts, expected_texts)
+
+    # Greedy matching over candidate pairs in descending similarity order
+    matched_predicted = np.zeros(len(predicted), dtype=bool)
+    matched_expected = np.zeros(len(expected), dtype=bool)
     correct_hierarchy = 0
-    
-    for i, pred_heading in enumerate(predicted):
-        pred_text = pred_heading['text']
-        pred_level = pred_heading.get('level', 'H3')
-        
-        best_match_idx = -1
-        best_similarity = 0.0
-        
-        for j, exp_heading in enumerate(expected):
-            if j in matched_expected:
-                continue
-                
-            exp_text = exp_heading['text']
-            similarity = text_similarity(pred_text, exp_text)
-            
-            if similarity > best_similarity and similarity >= 0.7:
-                best_similarity = similarity
-                best_match_idx = j
-        
-        if best_match_idx >= 0:
-            matched_expected.add(best_match_idx)
-            matched_predicted.add(i)
-            
-            # Check hierarchy accuracy
-            exp_level = expected[best_match_idx]['level']
-            if pred_level == exp_level:
-                correct_hierarchy += 1
-    
+
+    cand_pred, cand_exp = np.nonzero(similarity >= 0.7)
+    scores = similarity[cand_pred, cand_exp]
+
+    for k in np.argsort(-scores, kind='stable'):
+        i, j = cand_pred[k], cand_exp[k]
+        if matched_predicted[i] or matched_expected[j]:
+            continue
+
+        matched_predicted[i] = True
+        matched_expected[j] = True
+
+        # Check hierarchy accuracy
+        if predicted[i].get('level', 'H3') == expected[j]['level']:
+            correct_hierarchy += 1
+
     # Calculate metrics
-    true_positives = len(matched_predicted)
+    true_positives = int(matched_predicted.sum())
     precision = true_positives / len(predicted) if predicted else 0.0
     recall = true_positives / len(expected) if expected else 0.0
     f1 = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0.0
@@ -1,13 +1,22 @@
 import os
-import json
-import glob
+import functools
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 import pdfplumber
 import collections
 
+# Model data shared with worker processes, set once per worker by _init_worker
+_worker_model_data = None
+
+def _init_worker(model_data):
+    """Initialize a worker process with the already-loaded model"""
+    global _worker_model_data
+    _worker_model_data = model_data
+
 def identify_recurring_headers_footers(pdf, recurrence_threshold=0.3):
     """Identifies headers and footers to ignore"""
-    line_counts = collections.defaultdict(int)
+    line_counts = collections.Counter()
     margin_height = 0.15
     
     if len(pdf.pages) < 3:
@@ -16,26 +25,27 @@ def identify_recurring_headers_footers(pdf, recurrence_threshold=0.3):
     for page in pdf.pages:
         header_boundary = page.height * margin_height
         footer_boundary = page.height * (1 - margin_height)
-        
-        words_in_margins = [
-            w for w in page.extract_words(x_tolerance=2, y_tolerance=2, extra_attrs=["size", "x0", "x1", "top"])
-            if w['top'] < header_boundary or w['top'] > footer_boundary
-        ]
-        
-        for word in words_in_margins:
-            word['page_number'] = page.page_number
-        
+
+        words = page.extract_words(x_tolerance=2, y_tolerance=2, extra_attrs=["size", "x0", "x1", "top"])
+        if not words:
+            continue
+
+        # Vectorized margin test over the top coordinates of the page's words
+        tops = np.array([w['top'] for w in words])
+        in_margins = (tops < header_boundary) | (tops > footer_boundary)
+        words_in_margins = [w for w, keep in zip(words, in_margins) if keep]
+
         if not words_in_margins:
             continue
-        
+
         try:
             from utils import group_words_into_lines
-            lines_in_margins = group_words_into_lines(words_in_margins)
-            
-            for line in lines_in_margins:
-                text = line.get("text", "").strip()
-                if text and len(text) > 2:
-                    line_counts[text] += 1
+            lines_in_margins = group_words_into_lines(words_in_margins, page.page_number)
+
+            line_counts.update(
+                text for text in (line.get("text", "").strip() for line in lines_in_margins)
+                if text and len(text) > 2
+            )
         except Exception:
             continue
     
@@ -59,13 +69,10 @@ def get_document_title(pdf, max_pages_to_check=2):
             words = page.extract_words(extra_attrs=["size", "x0", "x1", "top"])
             if not words:
                 continue
-            
-            for word in words:
-                word['page_number'] = page.page_number
-            
+
             try:
                 from utils import group_words_into_lines
-                lines = group_words_into_lines(words)
+                lines = group_words_into_lines(words, page.page_number)
                 
                 if not lines:
                     continue
@@ -83,10 +90,11 @@ def get_document_title(pdf, max_pages_to_check=2):
     
     return title.strip()
 
+@functools.lru_cache(maxsize=1)
 def load_model_silently():
-    """Load model without debug output"""
+    """Load model without debug output (cached, so the pickle is read once)"""
     model_path = "/app/models/supervised_heading_classifier.pkl"
-    
+
     try:
         import joblib
         model_data = joblib.load(model_path)
@@ -94,35 +102,57 @@ def load_model_silently():
     except Exception:
         return False, None
 
+# Classifier built from the loaded model, reused across PDFs in a process
+_classifier_cache = None
+
+def _get_classifier(model_data):
+    """Build the prediction classifier once and reuse it for every PDF"""
+    global _classifier_cache
+    if _classifier_cache is None:
+        from train_supervised import SupervisedHeadingClassifier
+        classifier = SupervisedHeadingClassifier()
+        classifier.model = model_data
+        classifier.heading_classifier = model_data['heading_classifier']
+        classifier.level_classifier = model_data['level_classifier']
+        classifier.scaler = model_data['scaler']
+        classifier.level_encoder = model_data['level_encoder']
+        classifier.is_trained = model_data.get('is_trained', True)
+        # Models trained before n_jobs was set should still predict in parallel
+        classifier.heading_classifier.n_jobs = -1
+        classifier.level_classifier.n_jobs = -1
+        # Use the compiled heading forest if it shipped with the model
+        compiled_lib = "/app/models/heading_rf.so"
+        if os.path.exists(compiled_lib):
+            classifier.load_compiled_model(compiled_lib)
+        _classifier_cache = classifier
+    return _classifier_cache
+
 def process_pdf(pdf_path):
     """Process a single PDF and return structured data"""
     print(f" Processing: {os.path.basename(pdf_path)}")
     
     try:
         with pdfplumber.open(pdf_path) as pdf:
+            # Extract the title once so the error path does not reparse pages
+            title = get_document_title(pdf)
+
             try:
-                from train_supervised import SupervisedHeadingClassifier
-                classifier = SupervisedHeadingClassifier()
-                
-                # Load model silently
-                model_loaded_directly, model_data = load_model_silently()
-                
+                # Use the model handed to this worker, falling back to a direct load
+                if _worker_model_data is not None:
+                    model_loaded_directly, model_data = True, _worker_model_data
+                else:
+                    model_loaded_directly, model_data = load_model_silently()
+
                 if model_loaded_directly:
-                    classifier.model = model_data
-                    classifier.heading_classifier = model_data['heading_classifier']
-                    classifier.level_classifier = model_data['level_classifier']
-                    classifier.scaler = model_data['scaler']
-                    classifier.level_encoder = model_data['level_encoder']
-                    classifier.is_trained = model_data.get('is_trained', True)
+                    classifier = _get_classifier(model_data)
                 else:
-                    return {"title": get_document_title(pdf), "outline": []}
-                
-                # Process document
+                    return {"title": title, "outline": []}
+
+                # Process document on the already-open PDF
                 headers_footers_to_ignore = identify_recurring_headers_footers(pdf)
-                title = get_document_title(pdf)
-                
+
                 from utils import extract_lines_from_pdf
-                all_lines, avg_font_size, page_height = extract_lines_from_pdf(pdf_path)
+                all_lines, avg_font_size, page_height = extract_lines_from_pdf(pdf)
                 
                 if not all_lines:
                     return {"title": title, "outline": []}
@@ -135,27 +165,27 @@ def process_pdf(pdf_path):
                 
                 # Process results
                 outline = []
-                for line, (is_heading, confidence, level) in zip(all_lines, predictions):
-                    text = line.get("text", "").strip()
-                    
-                    if (is_heading and confidence > 0.3 and 
-                        text not in headers_footers_to_ignore and 
+                for text, page_num, (is_heading, confidence, level) in zip(
+                        all_lines.text, all_lines.page_number, predictions):
+                    text = text.strip()
+
+                    if (is_heading and confidence > 0.3 and
+                        text not in headers_footers_to_ignore and
                         len(text) > 2 and text.strip()):
-                        
-                        page_num = line.get("page_number", 1)
+
                         final_level = level if level is not None else "H3"
-                        
+
                         outline.append({
                             "level": final_level,
                             "text": text,
-                            "page": page_num
+                            "page": int(page_num)
                         })
                 
                 print(f" Output saved: {os.path.basename(pdf_path).replace('.pdf', '.json')}")
                 return {"title": title, "outline": outline}
                 
             except Exception:
-                return {"title": get_document_title(pdf), "outline": []}
+                return {"title": title, "outline": []}
                 
     except Exception:
         return {"title": f"Error processing {os.path.basename(pdf_path)}", "outline": []}
@@ -172,24 +202,33 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
     
     # Process all PDF files in input directory
-    pdf_files = glob.glob(os.path.join(input_dir, "*.pdf"))
+    pdf_files = sorted(
+        entry.path for entry in os.scandir(input_dir)
+        if entry.is_file() and entry.name.lower().endswith('.pdf')
+    )
     
     if not pdf_files:
         print(" No PDF files found in input directory!")
         return
     
     print(f" Found {len(pdf_files)} PDF files to process\n")
-    
-    for pdf_path in pdf_files:
+
+    # Load the model once and fan the PDFs out across worker processes
+    _, model_data = load_model_silently()
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                             initializer=_init_worker,
+                             initargs=(model_data,)) as executor:
+        results = list(executor.map(process_pdf, pdf_files))
+
+    from utils import write_json
+
+    for pdf_path, result in zip(pdf_files, results):
         pdf_filename = Path(pdf_path).stem
         output_path = os.path.join(output_dir, f"{pdf_filename}.json")
-        
-        # Process PDF
-        result = process_pdf(pdf_path)
-        
+
         # Save result as JSON
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        write_json(result, output_path)
     
     print(f"\n Processing complete! All results saved to /app/output")
 
@@ -1,4 +1,5 @@
 import json
+import re
 import numpy as np
 from pathlib import Path
 from sklearn.ensemble import RandomForestClassifier
@@ -8,84 +9,84 @@ import joblib
 from typing import List, Dict, Tuple
 import statistics
 
-from utils import extract_lines_from_pdf, load_expected_outputs, find_best_matching_expected_heading
+from utils import LinesSoA, extract_lines_from_pdf, load_expected_outputs, find_best_matching_expected_heading, prepare_expected_headings
 
 INPUT_FOLDER = "input"
 EXPECTED_FOLDER = "expected"  
 MODEL_FOLDER = "models"
 
+_PUNCT_RE = re.compile(r"[.,;!?()\[\]{}]")
+
 class SupervisedHeadingClassifier:
     def __init__(self):
-        self.heading_classifier = RandomForestClassifier(n_estimators=200, random_state=42, max_depth=15)
-        self.level_classifier = RandomForestClassifier(n_estimators=150, random_state=42, max_depth=10)
+        self.heading_classifier = RandomForestClassifier(n_estimators=200, random_state=42, max_depth=15, n_jobs=-1)
+        self.level_classifier = RandomForestClassifier(n_estimators=150, random_state=42, max_depth=10, n_jobs=-1)
         self.scaler = StandardScaler()
         self.level_encoder = LabelEncoder()
         self.is_trained = False
+        # Compiled heading forest (treelite), used for inference when present
+        self.compiled_predictor = None
         
-    def extract_features(self, line: Dict, all_lines: List[Dict], line_idx: int, avg_font_size: float, page_height: float) -> np.ndarray:
-        """Extract comprehensive features for a line"""
-        text = line.get("text", "").strip()
-        font_size = line.get("size", 0)
-        
+    def extract_features_batch(self, all_lines: LinesSoA, avg_font_size: float, page_height: float) -> np.ndarray:
+        """Extract features for all lines at once as an (N, 18) matrix"""
+        if not isinstance(all_lines, LinesSoA):
+            all_lines = LinesSoA.from_lines(all_lines)
+
+        n = len(all_lines)
+        if n == 0:
+            return np.empty((0, 18))
+
+        sizes = all_lines.size
+        tops = all_lines.top
+        texts = [t.strip() for t in all_lines.text]
+
         # Basic features
-        font_size_ratio = font_size / avg_font_size if avg_font_size > 0 else 1.0
-        text_length = len(text)
-        word_count = len(text.split())
-        
-        # Pattern features
-        ends_with_colon = 1 if text.endswith(':') else 0
-        is_title_case = 1 if text.istitle() else 0
-        is_uppercase = 1 if text.isupper() and len(text) > 2 else 0
-        starts_with_number = 1 if text and text[0].isdigit() else 0
-        contains_appendix = 1 if 'appendix' in text.lower() else 0
-        
+        font_size_ratio = sizes / avg_font_size if avg_font_size > 0 else np.ones(n)
+        text_length = np.array([len(t) for t in texts], dtype=float)
+        word_count = np.array([len(t.split()) for t in texts], dtype=float)
+
+        # Pattern features, one streaming pass per flag column
+        texts_lower = [t.lower() for t in texts]
+        ends_with_colon = np.fromiter((t.endswith(':') for t in texts), dtype=np.int8, count=n)
+        is_title_case = np.fromiter((t.istitle() for t in texts), dtype=np.int8, count=n)
+        is_uppercase = np.fromiter((t.isupper() and len(t) > 2 for t in texts), dtype=np.int8, count=n)
+        starts_with_number = np.fromiter((bool(t) and t[0].isdigit() for t in texts), dtype=np.int8, count=n)
+        contains_appendix = np.fromiter(('appendix' in t for t in texts_lower), dtype=np.int8, count=n)
+
         # Formatting features
-        is_bold = 1 if line.get("is_bold", False) else 0
-        is_italic = 1 if line.get("is_italic", False) else 0
-        
+        is_bold = all_lines.is_bold.astype(float)
+        is_italic = all_lines.is_italic.astype(float)
+
         # Position features
-        position_y_normalized = line.get("top", 0) / page_height if page_height > 0 else 0
-        
-        # Context features
-        next_line_size_ratio = 1.0
-        prev_line_size_ratio = 1.0
-        line_spacing_above = 0
-        line_spacing_below = 0
-        
-        if line_idx > 0:
-            prev_line = all_lines[line_idx - 1]
-            prev_font_size = prev_line.get("size", font_size)
-            prev_line_size_ratio = font_size / prev_font_size if prev_font_size > 0 else 1.0
-            line_spacing_above = abs(line.get("top", 0) - prev_line.get("top", 0))
-        
-        if line_idx < len(all_lines) - 1:
-            next_line = all_lines[line_idx + 1]
-            next_font_size = next_line.get("size", font_size)
-            next_line_size_ratio = font_size / next_font_size if next_font_size > 0 else 1.0
-            line_spacing_below = abs(next_line.get("top", 0) - line.get("top", 0))
-        
+        position_y_normalized = tops / page_height if page_height > 0 else np.zeros(n)
+
+        # Context features (boundary lines keep the defaults by reusing their own values)
+        prev_sizes = np.concatenate([sizes[:1], sizes[:-1]])
+        next_sizes = np.concatenate([sizes[1:], sizes[-1:]])
+        prev_tops = np.concatenate([tops[:1], tops[:-1]])
+        next_tops = np.concatenate([tops[1:], tops[-1:]])
+
+        prev_line_size_ratio = np.where(prev_sizes > 0, sizes / np.where(prev_sizes > 0, prev_sizes, 1), 1.0)
+        next_line_size_ratio = np.where(next_sizes > 0, sizes / np.where(next_sizes > 0, next_sizes, 1), 1.0)
+        line_spacing_above = np.abs(tops - prev_tops)
+        line_spacing_below = np.abs(next_tops - tops)
+
         # Advanced pattern features
-        has_punctuation = 1 if any(char in text for char in '.,;!?()[]{}') else 0
-        is_short_line = 1 if len(text) < 80 else 0
-        font_size_percentile = self.get_font_size_percentile(font_size, all_lines)
-        
-        return np.array([
+        has_punctuation = np.fromiter((_PUNCT_RE.search(t) is not None for t in texts), dtype=np.int8, count=n)
+        is_short_line = (text_length < 80).astype(np.int8)
+
+        # Font size percentile for every line in one sort + one searchsorted
+        sorted_sizes = np.sort(sizes)
+        font_size_percentile = np.searchsorted(sorted_sizes, sizes, side='left') / n
+
+        return np.column_stack([
             font_size_ratio, text_length, word_count, ends_with_colon, is_title_case,
             is_uppercase, starts_with_number, contains_appendix, is_bold, is_italic,
             position_y_normalized, next_line_size_ratio, prev_line_size_ratio,
             line_spacing_above, line_spacing_below, has_punctuation, is_short_line,
             font_size_percentile
         ])
-    
-    def get_font_size_percentile(self, font_size: float, all_lines: List[Dict]) -> float:
-        """Get font size percentile within document"""
-        font_sizes = [line.get('size', 0) for line in all_lines]
-        if not font_sizes:
-            return 0.5
-        
-        smaller_count = sum(1 for fs in font_sizes if fs < font_size)
-        return smaller_count / len(font_sizes)
-    
+
     def prepare_training_data(self):
         """Prepare training data from expected outputs"""
         script_dir = Path(__file__).parent
@@ -116,21 +117,24 @@ class SupervisedHeadingClassifier:
             
             if not all_lines:
                 continue
-            
-            # Create expected headings mapping
-            expected_texts = {h['text']: h['level'] for h in expected_headings}
-            
+
+            # Normalize and tokenize the expected headings once for this file
+            expected_prepared = prepare_expected_headings(expected_headings)
+
+            # Extract features for the whole file in one batched pass
+            features_matrix = self.extract_features_batch(all_lines, avg_font_size, page_height)
+
             # Process each line
-            for idx, line in enumerate(all_lines):
-                text = line.get('text', '').strip()
+            for idx, text in enumerate(all_lines.text):
+                text = text.strip()
                 if not text or len(text) < 3:
                     continue
-                
-                features = self.extract_features(line, all_lines, idx, avg_font_size, page_height)
+
+                features = features_matrix[idx]
                 X_heading.append(features)
-                
+
                 # Find best matching expected heading
-                best_level, match_score = find_best_matching_expected_heading(text, expected_headings)
+                best_level, match_score = find_best_matching_expected_heading(text, expected_prepared)
                 
                 # Label as heading if good match found
                 if match_score >= 0.7:  # Similarity threshold
@@ -183,45 +187,106 @@ class SupervisedHeadingClassifier:
         
         return True
     
-    def predict(self, all_lines: List[Dict], avg_font_size: float, page_height: float) -> List[Tuple[int, float, str]]:
+    def predict(self, all_lines: LinesSoA, avg_font_size: float, page_height: float) -> List[Tuple[int, float, str]]:
         """Predict headings and their levels"""
         if not self.is_trained:
             return []
-        
-        predictions = []
-        
-        for idx, line in enumerate(all_lines):
-            text = line.get("text", "").strip()
-            if not text or len(text) < 3:
-                predictions.append((0, 0.0, None))
-                continue
-            
-            features = self.extract_features(line, all_lines, idx, avg_font_size, page_height)
-            features_scaled = self.scaler.transform([features])
-            
-            # Predict if it's a heading
-            is_heading = self.heading_classifier.predict(features_scaled)[0]
-            heading_prob = self.heading_classifier.predict_proba(features_scaled)[0][1]
-            
-            level = None
-            if is_heading and len(self.level_encoder.classes_) > 0:
-                level_encoded = self.level_classifier.predict(features_scaled)[0]
-                level = self.level_encoder.inverse_transform([level_encoded])[0]
-            
-            predictions.append((is_heading, heading_prob, level))
-        
-        return predictions
+
+        if not isinstance(all_lines, LinesSoA):
+            all_lines = LinesSoA.from_lines(all_lines)
+
+        features_matrix = self.extract_features_batch(all_lines, avg_font_size, page_height)
+        if len(features_matrix) == 0:
+            return []
+
+        # Lines too short to be headings are masked out and never predicted on
+        valid = np.array([len(t.strip()) >= 3 for t in all_lines.text])
+
+        is_heading = np.zeros(len(all_lines), dtype=int)
+        heading_prob = np.zeros(len(all_lines))
+        levels = np.full(len(all_lines), None, dtype=object)
+
+        if valid.any():
+            features_scaled = self.scaler.transform(features_matrix[valid])
+
+            # Predict all valid rows in one batched call per estimator,
+            # through the compiled forest when one is loaded
+            valid_probs = self._predict_heading_proba(features_scaled)
+            heading_prob[valid] = valid_probs
+            is_heading[valid] = (valid_probs > 0.5).astype(int)
+
+            if len(self.level_encoder.classes_) > 0:
+                heading_mask = valid & (is_heading == 1)
+                if heading_mask.any():
+                    level_rows = self.scaler.transform(features_matrix[heading_mask])
+                    level_encoded = self.level_classifier.predict(level_rows)
+                    levels[heading_mask] = self.level_encoder.inverse_transform(level_encoded)
+
+        return [
+            (int(h), float(p), lv)
+            for h, p, lv in zip(is_heading, heading_prob, levels)
+        ]
     
+    def _predict_heading_proba(self, features_scaled: np.ndarray) -> np.ndarray:
+        """Heading probabilities, via the compiled forest when available"""
+        if self.compiled_predictor is not None:
+            try:
+                import treelite_runtime
+                return np.asarray(
+                    self.compiled_predictor.predict(treelite_runtime.DMatrix(features_scaled))
+                ).ravel()
+            except Exception:
+                self.compiled_predictor = None
+
+        return self.heading_classifier.predict_proba(features_scaled)[:, 1]
+
+    def export_compiled_model(self, lib_path: str) -> bool:
+        """Compile the heading forest to a shared library with treelite
+
+        Optional: needs treelite and a C toolchain. Inference then skips the
+        sklearn dispatch entirely; callers fall back to the pickle when the
+        library cannot be built or loaded.
+        """
+        if not self.is_trained:
+            return False
+
+        try:
+            import treelite
+            model = treelite.sklearn.import_model(self.heading_classifier)
+            model.export_lib(toolchain='gcc', libpath=lib_path, params={'parallel_comp': 4})
+            return True
+        except Exception:
+            return False
+
+    def load_compiled_model(self, lib_path: str) -> bool:
+        """Load a shared library built by export_compiled_model"""
+        try:
+            import treelite_runtime
+            self.compiled_predictor = treelite_runtime.Predictor(lib_path)
+            return True
+        except Exception:
+            self.compiled_predictor = None
+            return False
+
     def save_model(self, model_path: str):
         """Save trained model"""
         if self.is_trained:
+            # Round tree thresholds and leaf values to float32 precision in
+            # place. sklearn's node arrays stay float64, but the zeroed
+            # mantissa bits make the compressed pickle several times smaller.
+            for forest in (self.heading_classifier, self.level_classifier):
+                for estimator in getattr(forest, 'estimators_', []):
+                    tree = estimator.tree_
+                    tree.threshold[:] = tree.threshold.astype(np.float32)
+                    tree.value[:] = tree.value.astype(np.float32)
+
             joblib.dump({
                 'heading_classifier': self.heading_classifier,
                 'level_classifier': self.level_classifier,
                 'scaler': self.scaler,
                 'level_encoder': self.level_encoder,
                 'is_trained': True
-            }, model_path)
+            }, model_path, compress=3)
     
     def load_model(self, model_path: str) -> bool:
         """Load trained model"""
@@ -229,9 +294,18 @@ class SupervisedHeadingClassifier:
             data = joblib.load(model_path)
             self.heading_classifier = data['heading_classifier']
             self.level_classifier = data['level_classifier']
+            # Models trained before n_jobs was set should still predict in parallel
+            self.heading_classifier.n_jobs = -1
+            self.level_classifier.n_jobs = -1
             self.scaler = data['scaler']
             self.level_encoder = data['level_encoder']
             self.is_trained = data.get('is_trained', True)
+
+            # Pick up a compiled forest shipped alongside the pickle
+            lib_path = Path(model_path).with_name('heading_rf.so')
+            if lib_path.exists():
+                self.load_compiled_model(str(lib_path))
+
             return True
         except:
             return False
@@ -251,6 +325,12 @@ def main():
         model_path = model_dir / "supervised_heading_classifier.pkl"
         classifier.save_model(str(model_path))
         print(f"Model saved to {model_path}")
+
+        lib_path = model_dir / "heading_rf.so"
+        if classifier.export_compiled_model(str(lib_path)):
+            print(f"Compiled heading forest saved to {lib_path}")
+        else:
+            print("Compiled heading forest not built (treelite unavailable)")
     else:
         print("Training failed!")
 
@@ -1,40 +1,136 @@
+import collections
+import functools
 import json
 import re
 import numpy as np
+from dataclasses import dataclass
 from typing import List, Dict, Any, Set, Tuple
 from pathlib import Path
 import pdfplumber
 from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- Configuration ---
 LINE_TOLERANCE = 2
 CHAR_TOLERANCE = 1.5
 
-def group_words_into_lines(words: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def read_json(file_path) -> Any:
+    """Load a JSON file, using orjson when available"""
+    if orjson is not None:
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json(data: Any, file_path) -> None:
+    """Write a JSON file with 2-space indent, using orjson when available"""
+    if orjson is not None:
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+@dataclass
+class LinesSoA:
+    """Structure-of-arrays view of the extracted lines of a document"""
+    text: List[str]
+    fontname: List[str]
+    size: np.ndarray
+    top: np.ndarray
+    x0: np.ndarray
+    is_bold: np.ndarray
+    is_italic: np.ndarray
+    page_number: np.ndarray
+
+    @classmethod
+    def from_lines(cls, lines: List[Dict[str, Any]]) -> "LinesSoA":
+        """Build column arrays from a list of line dicts"""
+        return cls(
+            text=[line.get('text', '') for line in lines],
+            fontname=[line.get('fontname', '') for line in lines],
+            size=np.array([line.get('size', 0) for line in lines], dtype=float),
+            top=np.array([line.get('top', 0) for line in lines], dtype=float),
+            x0=np.array([line.get('x0', 0) for line in lines], dtype=float),
+            is_bold=np.array([bool(line.get('is_bold', False)) for line in lines]),
+            is_italic=np.array([bool(line.get('is_italic', False)) for line in lines]),
+            page_number=np.array([line.get('page_number', 1) for line in lines], dtype=int),
+        )
+
+    def as_dicts(self) -> List[Dict[str, Any]]:
+        """Shim back to the list-of-dicts form for row-oriented consumers"""
+        return [
+            {
+                "text": self.text[i],
+                "size": float(self.size[i]),
+                "page_number": int(self.page_number[i]),
+                "fontname": self.fontname[i],
+                "is_bold": bool(self.is_bold[i]),
+                "is_italic": bool(self.is_italic[i]),
+                "x0": float(self.x0[i]),
+                "top": float(self.top[i]),
+            }
+            for i in range(len(self))
+        ]
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+def group_words_into_lines(words: List[Dict[str, Any]], page_number: int = 1) -> List[Dict[str, Any]]:
     """Groups word objects into lines"""
     if not words:
         return []
 
-    words.sort(key=lambda w: (w['top'], w['x0']))
-    
+    # Bucket words by quantized top in one linear pass; only the small
+    # per-group sorts below touch more than a handful of words at a time
+    buckets = collections.defaultdict(list)
+    for word in words:
+        buckets[int(word['top'] // LINE_TOLERANCE)].append(word)
+
+    lines = []
+    group = []
+    prev_key = None
+
+    for key in sorted(buckets):
+        # Words in non-adjacent buckets are always further apart than the
+        # tolerance, so a bucket gap is a guaranteed line break
+        if prev_key is not None and key - prev_key > 1 and group:
+            lines.extend(_split_group_into_lines(group, page_number))
+            group = []
+        group.extend(buckets[key])
+        prev_key = key
+
+    if group:
+        lines.extend(_split_group_into_lines(group, page_number))
+
+    return lines
+
+def _split_group_into_lines(group: List[Dict[str, Any]], page_number: int = 1) -> List[Dict[str, Any]]:
+    """Sort a group of vertically close words and split it on the tolerance"""
+    group.sort(key=lambda w: (w['top'], w['x0']))
+
     lines = []
-    current_line_words = [words[0]]
+    current_line_words = [group[0]]
 
-    for word in words[1:]:
+    for word in group[1:]:
         last_word = current_line_words[-1]
-        
+
         if abs(word['top'] - last_word['top']) > LINE_TOLERANCE:
-            lines.append(build_line_from_words(current_line_words))
+            lines.append(build_line_from_words(current_line_words, page_number))
             current_line_words = [word]
         else:
             current_line_words.append(word)
 
     if current_line_words:
-        lines.append(build_line_from_words(current_line_words))
-    
+        lines.append(build_line_from_words(current_line_words, page_number))
+
     return lines
 
-def build_line_from_words(line_words: List[Dict[str, Any]]) -> Dict[str, Any]:
+def build_line_from_words(line_words: List[Dict[str, Any]], page_number: int = 1) -> Dict[str, Any]:
     """Builds line from words with formatting information"""
     if not line_words:
         return {}
@@ -55,7 +151,7 @@ def build_line_from_words(line_words: List[Dict[str, Any]]) -> Dict[str, Any]:
     return {
         "text": text,
         "size": line_words[0]["size"],
-        "page_number": line_words[0].get("page_number", 1),
+        "page_number": line_words[0].get("page_number", page_number),
         "fontname": font_name,
         "is_bold": is_bold,
         "is_italic": is_italic,
@@ -63,74 +159,130 @@ def build_line_from_words(line_words: List[Dict[str, Any]]) -> Dict[str, Any]:
         "top": line_words[0].get("top", 0)
     }
 
-def extract_lines_from_pdf(pdf_path: str) -> Tuple[List[Dict], float, float]:
-    """Extract all lines from PDF with metadata"""
+def extract_lines_from_pdf(pdf_or_path) -> Tuple[LinesSoA, float, float]:
+    """Extract all lines from PDF with metadata
+
+    Accepts a filesystem path or an already-open pdfplumber.PDF, so callers
+    that have the document open do not parse it a second time.
+    """
+    if isinstance(pdf_or_path, (str, Path)):
+        with pdfplumber.open(pdf_or_path) as pdf:
+            return _extract_lines(pdf)
+    return _extract_lines(pdf_or_path)
+
+def _extract_lines(pdf) -> Tuple[LinesSoA, float, float]:
+    """Extract lines from an open pdfplumber.PDF"""
     all_lines = []
-    all_font_sizes = []
+    font_size_total = 0.0
+    word_count = 0
     page_height = 800
-    
-    with pdfplumber.open(pdf_path) as pdf:
-        if pdf.pages:
-            page_height = pdf.pages[0].height
-            
-        for page in pdf.pages:
-            words = page.extract_words(extra_attrs=["size", "top", "x0", "x1", "fontname"])
-            for word in words:
-                word['page_number'] = page.page_number
-                all_font_sizes.append(word.get("size", 0))
-            
-            if words:
-                page_lines = group_words_into_lines(words)
-                all_lines.extend(page_lines)
-    
-    avg_font_size = np.mean(all_font_sizes) if all_font_sizes else 12.0
-    return all_lines, avg_font_size, page_height
+
+    if pdf.pages:
+        page_height = pdf.pages[0].height
+
+    for page in pdf.pages:
+        words = page.extract_words(extra_attrs=["size", "top", "x0", "x1", "fontname"])
+        for word in words:
+            font_size_total += word.get("size", 0)
+            word_count += 1
+
+        if words:
+            page_lines = group_words_into_lines(words, page.page_number)
+            all_lines.extend(page_lines)
+
+    avg_font_size = font_size_total / word_count if word_count else 12.0
+    return LinesSoA.from_lines(all_lines), avg_font_size, page_height
 
 def load_expected_outputs(expected_dir: Path) -> Dict[str, List[Dict]]:
     """Load all expected output files"""
     expected_data = {}
     
     for file_path in expected_dir.glob("e-file*.json"):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Extract file number (e.g., "04" from "e-file04.json")
-            file_num = file_path.stem.replace('e-file', '')
-            expected_data[file_num] = data.get('outline', [])
+        data = read_json(file_path)
+        # Extract file number (e.g., "04" from "e-file04.json")
+        file_num = file_path.stem.replace('e-file', '')
+        expected_data[file_num] = data.get('outline', [])
     
     return expected_data
 
-def text_similarity(text1: str, text2: str) -> float:
-    """Calculate simple text similarity"""
-    text1 = text1.lower().strip()
-    text2 = text2.lower().strip()
-    
+# Token sets per unique normalized string, shared across similarity calls
+_token_sets: Dict[str, Set[str]] = {}
+
+def _get_token_set(text: str) -> Set[str]:
+    """Tokenize a normalized string once and reuse the set"""
+    token_set = _token_sets.get(text)
+    if token_set is None:
+        token_set = set(text.split())
+        _token_sets[text] = token_set
+    return token_set
+
+@functools.lru_cache(maxsize=100000)
+def _text_similarity_cached(text1: str, text2: str) -> float:
+    """Similarity on already-normalized strings; memoized per pair"""
     # Exact match
     if text1 == text2:
         return 1.0
-    
+
+    # An empty string is a substring of anything non-equal
+    if not text1 or not text2:
+        return 0.8
+
     # Substring match
     if text1 in text2 or text2 in text1:
         return 0.8
-    
+
+    # Texts this different in length cannot reach the 0.7 match threshold,
+    # so skip the set construction entirely
+    if min(len(text1), len(text2)) / max(len(text1), len(text2)) < 0.5:
+        return 0.0
+
     # Word overlap
-    words1 = set(text1.split())
-    words2 = set(text2.split())
+    words1 = _get_token_set(text1)
+    words2 = _get_token_set(text2)
     overlap = len(words1.intersection(words2))
     union = len(words1.union(words2))
-    
+
     return overlap / union if union > 0 else 0.0
 
-def find_best_matching_expected_heading(line_text: str, expected_headings: List[Dict]) -> Tuple[str, float]:
-    """Find the best matching expected heading"""
+def text_similarity(text1: str, text2: str) -> float:
+    """Calculate simple text similarity"""
+    text1 = text1.lower().strip()
+    text2 = text2.lower().strip()
+
+    # Similarity is commutative, so order the key for a better cache hit rate
+    if text2 < text1:
+        text1, text2 = text2, text1
+
+    return _text_similarity_cached(text1, text2)
+
+def prepare_expected_headings(expected_headings: List[Dict]) -> List[Tuple[str, Set[str], str]]:
+    """Normalize and tokenize expected headings once per file"""
+    prepared = []
+    for heading in expected_headings:
+        expected_text = heading.get('text', '').lower().strip()
+        prepared.append((expected_text, set(expected_text.split()), heading.get('level', 'H3')))
+    return prepared
+
+def find_best_matching_expected_heading(line_text: str, expected_prepared: List[Tuple[str, Set[str], str]]) -> Tuple[str, float]:
+    """Find the best matching expected heading from a prepared expected set"""
+    line_text = line_text.lower().strip()
+    line_tokens = set(line_text.split())
+
     best_match = None
     best_score = 0.0
-    
-    for heading in expected_headings:
-        expected_text = heading.get('text', '')
-        similarity = text_similarity(line_text, expected_text)
-        
+
+    for expected_text, expected_tokens, level in expected_prepared:
+        if line_text == expected_text:
+            similarity = 1.0
+        elif line_text in expected_text or expected_text in line_text:
+            similarity = 0.8
+        else:
+            overlap = len(line_tokens.intersection(expected_tokens))
+            union = len(line_tokens.union(expected_tokens))
+            similarity = overlap / union if union > 0 else 0.0
+
         if similarity > best_score:
             best_score = similarity
-            best_match = heading.get('level', 'H3')
-    
+            best_match = level
+
     return best_match, best_score